@@ -4,25 +4,38 @@ import pandas as pd
 import heapq
 import geopandas as gpd
 from shapely.geometry import Point, LineString
+from shapely.ops import substring
 import random as rd
 from geopy.geocoders import Nominatim
+from geopy.extra.rate_limiter import RateLimiter
 from pyproj import Transformer
+from functools import lru_cache
+from collections import defaultdict, OrderedDict
+import webbrowser
+
+#built once, from_crs is far more expensive than the transform itself
+TO_3857 = Transformer.from_crs(4326, 3857, always_xy=True)
+#one geolocator for every lookup, so its HTTP session and connection pool are reused
+GEOLOCATOR = Nominatim(user_agent="geo", timeout=5)
+#Nominatim usage policy allows one request per second, space them out instead of getting HTTP 429
+GEOCODE = RateLimiter(GEOLOCATOR.geocode, min_delay_seconds=1, max_retries=2, swallow_exceptions=False)
+
+# cached per address, the same text always geocodes to the same place (failed requests raise and are not cached)
+@lru_cache(maxsize=1024)
+def geocode_xy(address: str) -> tuple[float, float] | None:
+    location = GEOCODE(address)
 
+    if location:
+        #convert to metric projection (EPSG:3857) if location is found
+        return TO_3857.transform(location.longitude, location.latitude)
+    else:
+        return None
 
 def point_from_text(address: str) -> Point:
     if address is None:
         return None
-    geolocator = Nominatim(user_agent="geo")
-    location = geolocator.geocode(address)
-    #convert to metric projection (EPSG:3857)
-    transformer = Transformer.from_crs(4326, 3857, always_xy=True)
-
-    if location:
-        #apply transformation if location is found
-        x, y = transformer.transform(location.longitude, location.latitude)
-        return Point(x, y)
-    else:
-        return None
+    xy = geocode_xy(address)
+    return Point(xy) if xy is not None else None
     
 
 #src and dst are Point in meters, crs EPSG:3857
@@ -41,21 +54,17 @@ def openMap(m):
     html = "map.html"
     m.save(html)
 
-    import webbrowser
     webbrowser.open(html)
 
 # Function to trim a LineString shape between two stops
-from shapely.geometry import LineString, Point
-from shapely.ops import substring
-
-def trim_shape_between_stops(shape_geometry, stops_on_route, stops_df):
+def trim_shape_between_stops(shape_geometry, stops_on_route, stop_geometries):
     """
     Trim a shape LineString to only include the portion between first and last stop used.
     
     Args:
         shape_geometry: The full LineString of the shape
         stops_on_route: List of stop_ids that are used in this segment
-        stops_df: DataFrame with stop information including geometry
+        stop_geometries: Series of stop geometries indexed by stop_id
     
     Returns:
         Trimmed LineString
@@ -64,8 +73,8 @@ def trim_shape_between_stops(shape_geometry, stops_on_route, stops_df):
         return shape_geometry
     
     # Get the stop geometries
-    first_stop = stops_df[stops_df['stop_id'] == stops_on_route[0]].iloc[0]['geometry']
-    last_stop = stops_df[stops_df['stop_id'] == stops_on_route[-1]].iloc[0]['geometry']
+    first_stop = stop_geometries[stops_on_route[0]]
+    last_stop = stop_geometries[stops_on_route[-1]]
     
     # Project stops onto the line to get their position along the line
     first_distance = shape_geometry.project(first_stop)
@@ -86,16 +95,14 @@ def trim_shape_between_stops(shape_geometry, stops_on_route, stops_df):
 
 # Let's say you have a path like: [(stop1, shape1), (stop2, shape1), (stop3, shape2), ...]
 # Group stops by shape_id
-from collections import defaultdict
-
-def trim_route_shapes(dijkstra_path, transit_df, stops_df):
+def trim_route_shapes(dijkstra_path, transit_df, stop_geometries):
     """
     Trim shapes to only show the portions actually traveled.
     
     Args:
         dijkstra_path: List of (stop_id, shape_id) tuples from route
         transit_df: DataFrame with shape geometries
-        stops_df: DataFrame with stop information
+        stop_geometries: Series of stop geometries indexed by stop_id
     
     Returns:
         List of trimmed LineStrings with metadata
@@ -106,27 +113,31 @@ def trim_route_shapes(dijkstra_path, transit_df, stops_df):
         if shape_id != 'walking':  # Skip walking segments
             shape_stops[shape_id].append(stop_id)
     
+    # Only shapes traveled between at least two stops are drawn
+    shape_stops = {shape_id: stops for shape_id, stops in shape_stops.items() if len(stops) >= 2}
+
+    # Look up the row of every shape at once (first row per shape_id)
+    shape_rows = transit_df.drop_duplicates('shape_id').set_index('shape_id').reindex(list(shape_stops))
+    if 'route_color' not in shape_rows:
+        shape_rows['route_color'] = '#7b1fa2'
+
     trimmed_shapes = []
     
-    for shape_id, stops_on_shape in shape_stops.items():
-        if len(stops_on_shape) < 2:
-            continue
-            
+    for (shape_id, stops_on_shape), shape_row in zip(shape_stops.items(), shape_rows.itertuples(index=False)):
         # Get the full shape geometry
-        shape_row = transit_df[transit_df['shape_id'] == shape_id].iloc[0]
-        full_geometry = shape_row['shape_geometry']
+        full_geometry = shape_row.shape_geometry
         
         # Trim to actual stops used
-        trimmed_geom = trim_shape_between_stops(full_geometry, stops_on_shape, stops_df)
+        trimmed_geom = trim_shape_between_stops(full_geometry, stops_on_shape, stop_geometries)
         
         trimmed_shapes.append({
             'geometry': trimmed_geom,
             'shape_id': shape_id,
-            'route_long_name': shape_row['route_long_name'],
-            'route_short_name': shape_row['route_short_name'],
-            'route_type': shape_row['route_type'],
-            'trip_headsign': shape_row['trip_headsign'],
-            'route_color': shape_row.get('route_color', '#7b1fa2'),
+            'route_long_name': shape_row.route_long_name,
+            'route_short_name': shape_row.route_short_name,
+            'route_type': shape_row.route_type,
+            'trip_headsign': shape_row.trip_headsign,
+            'route_color': shape_row.route_color,
             'stops_used': stops_on_shape
         })
     
@@ -134,7 +145,7 @@ def trim_route_shapes(dijkstra_path, transit_df, stops_df):
 
 
 # Usage example (uncomment when you have a dijkstra_path):
-# trimmed = trim_route_shapes(dijkstra_path, transit_df, stops_df)
+# trimmed = trim_route_shapes(dijkstra_path, transit_df, stop_geometries)
 # trimmed_gdf = gpd.GeoDataFrame(trimmed, crs='EPSG:4326')
 # m = trimmed_gdf.explore(column='route_name', cmap='tab20')
 # openMap(m)
@@ -145,6 +156,11 @@ class RouteService:
         self.graph_transit = graph_transit
         self.stops_gdf = gpd.GeoDataFrame(stops_df, geometry='geometry', crs="EPSG:4326").to_crs(epsg=3857)
         self.transit_gdf = gpd.GeoDataFrame(transit_df, geometry='shape_geometry', crs='EPSG:4326').to_crs(epsg=3857)
+        # Stop geometry by stop_id, for lookups that only need the location and not the rest of the stop data
+        self.stop_geometries = self.stops_gdf.drop_duplicates('stop_id').set_index('stop_id').geometry
+        # Transit searches already solved, keyed by (start stop, end stop), least recently used dropped first
+        self.transit_paths = OrderedDict()
+        self.max_transit_paths = 256
 
    
     def route_walking(self, start_walking_node:int, end_walking_node: int) -> tuple[LineString, int]:
@@ -169,7 +185,15 @@ class RouteService:
     
     def route_transit(self, start_transit_node: str, end_transit_node: str) -> tuple[list[LineString], float]:
         
-        path, total_cost = self.dijkstra_transit(start_transit_node, end_transit_node, heuristic=euclidean_heuristic)
+        #the graph does not change during the service life, so the same stop pair always gives the same path
+        key = (start_transit_node, end_transit_node)
+        if key in self.transit_paths:
+            self.transit_paths.move_to_end(key)
+        else:
+            self.transit_paths[key] = self.dijkstra_transit(start_transit_node, end_transit_node, heuristic=euclidean_heuristic)
+            if len(self.transit_paths) > self.max_transit_paths:
+                self.transit_paths.popitem(last=False)
+        path, total_cost = self.transit_paths[key]
 
         dijkstra_path_stops = []
         dijkstra_path_shapes = []
@@ -182,7 +206,7 @@ class RouteService:
        
         subset = self.transit_gdf[self.transit_gdf['shape_id'].isin(dijkstra_path_shapes)]
 
-        trimmed_shapes = trim_route_shapes(path, self.transit_gdf, self.stops_gdf)
+        trimmed_shapes = trim_route_shapes(path, self.transit_gdf, self.stop_geometries)
 
         trimmed_gdf = gpd.GeoDataFrame(trimmed_shapes, crs='EPSG:4326')
 
@@ -196,7 +220,9 @@ class RouteService:
             cmap='tab20',
             legend=True,
             tooltip=['route_long_name', 'route_short_name', 'trip_headsign'],
-            style_kwds={'weight': 6, 'opacity': 0.9}
+            style_kwds={'weight': 6, 'opacity': 0.9},
+            #canvas renderer, the route and stop layers are drawn on one canvas instead of one SVG node each
+            map_kwds={'prefer_canvas': True}
         )
 
         path_gdf = self.stops_gdf[self.stops_gdf['stop_id'].isin(dijkstra_path_stops)]
@@ -256,7 +282,7 @@ class RouteService:
 
 
 
-    def check_no_transfers(graph:nx.MultiDiGraph, src, dst, transit_df, stops_df):
+    def check_no_transfers(graph:nx.DiGraph, src, dst, transit_df, stops_df):
 
 
         #verify if src and dst share a shape, only one bus is taken
@@ -286,7 +312,7 @@ class RouteService:
     
 
 
-    def check_one_transfer(graph:nx.MultiDiGraph, src:str, dst:str, transit_df: pd.DataFrame, stops_df: pd.DataFrame):
+    def check_one_transfer(graph:nx.DiGraph, src:str, dst:str, transit_df: pd.DataFrame, stops_df: pd.DataFrame):
     
         #verif if src and dst shapes share a stop, only one transfer is needed
         src_shapes = set(stops_df[stops_df['stop_id'] == src]['shapes_by_stop'].iloc[0])
@@ -335,19 +361,24 @@ class RouteService:
 
         graph = self.graph_transit
 
+        #heuristic only depends on the node, cache it per node for this search (parallel edges relax the same node many times)
+        dst_pos = graph.nodes[dst]['pos']
+        heuristic_cache = dict()
+
+        def node_heuristic(node):
+            h = heuristic_cache.get(node)
+            if h is None:
+                h = heuristic(graph.nodes[node]['pos'], dst_pos)
+                heuristic_cache[node] = h
+            return h
+
         # fill the queue with all the possible starting edges from src
-        for neighbor in graph.neighbors(src):
-            edges = graph.get_edge_data(src, neighbor)
-            if not edges:
-                continue
-            for k, attrs in edges.items():
-                shape_id = attrs.get('shape_id')
-                weight = attrs.get('weight', 1)
-                frequency = attrs.get('frequency', 600)
+        for neighbor, edge in graph.adj[src].items():
+            for shape_id, (weight, frequency) in edge['by_shape'].items():
                 tentative_cost = weight + frequency #initial transfer penalty
                 cost[(neighbor, shape_id)] = tentative_cost
                 previous[(neighbor, shape_id)] = (src, None)
-                heuristic_cost = heuristic(graph.nodes[neighbor]['pos'], graph.nodes[dst]['pos'])
+                heuristic_cost = node_heuristic(neighbor)
                 priority_cost = tentative_cost + heuristic_cost
                 heapq.heappush(queue, (priority_cost, neighbor, shape_id))
         
@@ -363,18 +394,11 @@ class RouteService:
                 break
 
 
-            # explore all neighbors (MultiDiGraph may have parallel edges)
-            for neighbor in graph.neighbors(current):
+            # explore all neighbors, each edge keeps the best weight per shape between both stops
+            for neighbor, edge in graph.adj[current].items():
+
+                for next_shape, (weight, frequency) in edge['by_shape'].items():
 
-                edges = graph.get_edge_data(current, neighbor)
-                if not edges:
-                    continue
-                
-                for k, attrs in edges.items():
-                    next_shape = attrs.get('shape_id')
-                    weight = attrs.get('weight', 1)
-                    frequency = attrs.get('frequency', 600)
-                    
                     if (current_shape is not None and next_shape is not None and next_shape != current_shape):
                         penalty = frequency
                     else:
@@ -386,7 +410,7 @@ class RouteService:
                     if (neighbor, next_shape) not in cost or tentative_cost < cost[(neighbor, next_shape)]:
                         cost[(neighbor, next_shape)] = tentative_cost                
                         previous[(neighbor, next_shape)] = (current, current_shape)
-                        heuristic_cost = heuristic(graph.nodes[neighbor]['pos'], graph.nodes[dst]['pos']) + 2*penalty
+                        heuristic_cost = node_heuristic(neighbor) + 2*penalty
                         priority_cost = tentative_cost + heuristic_cost
                         heapq.heappush(queue, (priority_cost, neighbor, next_shape))
             
@@ -448,7 +472,9 @@ class RouteService:
             cmap='tab20',
             legend=True,
             tooltip=['route_long_name', 'route_short_name', 'trip_headsign'],
-            style_kwds={'weight': 6, 'opacity': 0.9}
+            style_kwds={'weight': 6, 'opacity': 0.9},
+            #canvas renderer, the route and stop layers are drawn on one canvas instead of one SVG node each
+            map_kwds={'prefer_canvas': True}
         )
         print(set(shapes_in_path))
 
@@ -2,20 +2,21 @@ import osmnx as ox
 import geopandas as gpd
 import networkx as nx
 import pandas as pd
+import numpy as np
+import shapely
 import os
 import pickle
+import hashlib
 
 
 class GraphLoader:
 
-    def create_graph_walk(self, graphfile_path, geojson_poly_path) -> nx.MultiGraph:
+    def create_graph_walk(self, graphfile_path, geojson_poly_path, network_type: str = "walk") -> nx.MultiGraph:
 
         # if graph pkl exists, load and return it
+        # an explicit file is trusted as is: it is not checked against the polygon, delete it to rebuild
         if os.path.exists(graphfile_path):
-            print(f"Loading walking graph from {graphfile_path}")
-            with open(graphfile_path, "rb") as f:
-                G = pickle.load(f)
-            return G
+            return load_graph(graphfile_path, "walking")
 
         # otherwise read geojson, build graph from polygon and save it
         gdf_poly = gpd.read_file(geojson_poly_path)
@@ -23,10 +24,15 @@ class GraphLoader:
             raise ValueError(f"No geometry found in {geojson_poly_path}")
         poly = gdf_poly.geometry.iloc[0]
 
+        # graph already built for the same polygon and network type
+        cache_path = graph_cache_path(graphfile_path, poly.wkb, network_type)
+        if os.path.exists(cache_path):
+            return load_graph(cache_path, "walking")
+
         print("Creating walking graph from OSM data")
 
         # retrieve walkable graph within polygon from open street maps
-        G = ox.graph_from_polygon(poly, network_type="walk")
+        G = ox.graph_from_polygon(poly, network_type=network_type)
         
         # change graph locations to be metric
         G = ox.project_graph(G, to_crs="EPSG:3857")
@@ -34,23 +40,22 @@ class GraphLoader:
         # assumption one can walk both ways on all paths, this simplifies the graph
         G = G.to_undirected()
 
-        with open(graphfile_path, "wb") as f:
-            pickle.dump(G, f)
-        print(f"Walking graph saved to {graphfile_path}")
+        save_graph(G, cache_path, "walking")
         return G
 
-    def create_graph_transit(self, graphfile_path, stops_df: pd.DataFrame, max_walking_time: int = 300) -> nx.MultiDiGraph:
+    def create_graph_transit(self, graphfile_path, stops_df: pd.DataFrame, max_walking_time: int = 300) -> nx.DiGraph:
         
-        graphfile_path = graphfile_path.rstrip(".pkl")
-        graphfile_path = f"{graphfile_path}_{max_walking_time}.pkl"
+        graphfile_path = f"{os.path.splitext(graphfile_path)[0]}_{max_walking_time}.pkl"
 
         # if graph pkl exists, load and return it
+        # an explicit file is trusted as is: it is not checked against the stops, delete it to rebuild
         if os.path.exists(graphfile_path):
-            print(f"Loading transit graph from {graphfile_path}")
-            with open(graphfile_path, "rb") as f:
-                G = pickle.load(f)
-            return G
-        
+            return load_transit_graph(graphfile_path)
+
+        # graph already built for the same stops, adjacency and max walking time
+        cache_path = graph_cache_path(graphfile_path, transit_graph_content(stops_df), "transit", max_walking_time)
+        if os.path.exists(cache_path):
+            return load_graph(cache_path, "transit")
         
         print("Creating transit graph")
         
@@ -63,21 +68,114 @@ class GraphLoader:
         add_adjacent_stops(graph_transit, stops_gdf)
         add_walking_edges(graph_transit, stops_gdf, max_walking_time)
 
-        with open(graphfile_path, "wb") as f:
-            pickle.dump(graph_transit, f)
-        print(f"Transit graph saved to {graphfile_path}")
+        # keep only the best edge per shape between each pair of stops
+        graph_transit = collapse_parallel_edges(graph_transit)
+
+        save_graph(graph_transit, cache_path, "transit")
+
+        return graph_transit
+
 
+def graph_cache_path(graphfile_path: str, content: bytes, *params) -> str:
+    """
+    Build the cache path of a graph from the content it is built from.
+    The file is stored next to graphfile_path and named after a hash of the
+    content (polygon WKB, stops and their adjacency) and the build parameters, so a graph is
+    only rebuilt when its inputs change. It is only consulted when there is no file at
+    graphfile_path itself, an existing file there bypasses the content key.
+    """
+    key = hashlib.blake2b(content, digest_size=8)
+    for param in params:
+        key.update(str(param).encode())
+    return os.path.join(os.path.dirname(graphfile_path), f"graph_{key.hexdigest()}.pkl")
+
+def transit_graph_content(stops_df: pd.DataFrame) -> bytes:
+    """
+    Bytes of everything the transit graph is built from: the stop ids, their geometry
+    (walking edges) and next_stop_id (travel times and frequencies of the transit edges).
+    Editing any of them in the feed changes the cache path, so a stale graph is never loaded.
+    """
+    stop_ids = pd.util.hash_pandas_object(stops_df['stop_id'], index=False).to_numpy().tobytes()
+    geometries = b"".join(shapely.to_wkb(stops_df['geometry'].to_numpy()))
+    adjacency = pickle.dumps(stops_df['next_stop_id'].tolist(), protocol=pickle.HIGHEST_PROTOCOL)
+    return b"".join([stop_ids, geometries, adjacency])
+
+def load_graph(graphfile_path: str, kind: str):
+    print(f"Loading {kind} graph from {graphfile_path}")
+    with open(graphfile_path, "rb") as f:
+        return pickle.load(f)
+
+def load_transit_graph(graphfile_path: str) -> nx.DiGraph:
+    """
+    Load a transit graph pickle as a DiGraph.
+    Pickles from before the collapse hold the MultiDiGraph, it is collapsed once and the
+    result kept in a graph_<hash>.pkl keyed on the pickle's name, size and mtime. The
+    original file is never rewritten, it may be tracked in git or read-only.
+    """
+    stat = os.stat(graphfile_path)
+    collapsed_path = graph_cache_path(graphfile_path, os.path.basename(graphfile_path).encode(), "collapsed", stat.st_size, stat.st_mtime_ns)
+    if os.path.exists(collapsed_path):
+        return load_graph(collapsed_path, "transit")
+
+    graph = load_graph(graphfile_path, "transit")
+    if graph.is_multigraph():
+        graph = collapse_parallel_edges(graph)
+        try:
+            save_graph(graph, collapsed_path, "transit")
+        except OSError:
+            # read-only checkout, the graph is collapsed again on the next run
+            pass
+    return graph
+
+def save_graph(G, graphfile_path: str, kind: str):
+    # written to a temporary file first, an interrupted save never leaves a truncated graph behind
+    tmp_path = f"{graphfile_path}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            pickle.dump(G, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, graphfile_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    print(f"{kind.capitalize()} graph saved to {graphfile_path}")
+
+
+def collapse_parallel_edges(graph_transit: nx.MultiDiGraph) -> nx.DiGraph:
+    """
+    Collapse the parallel edges of the transit MultiDiGraph into a DiGraph.
+    Between two stops only the fastest edge of each shape matters for routing, so every
+    (u, v) edge keeps 'by_shape' = {shape_id: (weight, frequency)} with the best weight per
+    shape, and 'weight' as the minimum across shapes for networkx shortest path functions.
+    Graphs that are already collapsed are returned as they are.
+    """
+    if not graph_transit.is_multigraph():
         return graph_transit
 
+    graph = nx.DiGraph()
+    graph.add_nodes_from(graph_transit.nodes(data=True))
+
+    for u, v, attrs in graph_transit.edges(data=True):
+        shape_id = attrs.get('shape_id')
+        candidate = (attrs.get('weight', 1), attrs.get('frequency', 600))
+        if not graph.has_edge(u, v):
+            graph.add_edge(u, v, weight=candidate[0], by_shape={shape_id: candidate})
+            continue
+        edge = graph[u][v]
+        by_shape = edge['by_shape']
+        if shape_id not in by_shape or candidate < by_shape[shape_id]:
+            by_shape[shape_id] = candidate
+        edge['weight'] = min(edge['weight'], candidate[0])
+
+    return graph
 
 def add_adjacent_stops(graph_transit: nx.MultiDiGraph, stops_gdf:gpd.GeoDataFrame):
 
     print("Adding transit edges between adjacent stops")    
 
-    for idx, stop in stops_gdf.iterrows():
-        stop_id = stop['stop_id']
-        graph_transit.add_node(stop_id, pos=stop['geometry'], stop_name=stop['stop_name'], routes=stop['routes_by_stop'], shapes=stop['shapes_by_stop'])
-        next_stops = stop['next_stop_id']
+    cols = ['stop_id', 'geometry', 'stop_name', 'routes_by_stop', 'shapes_by_stop', 'next_stop_id']
+
+    for stop_id, geometry, stop_name, routes, shapes, next_stops in stops_gdf[cols].itertuples(index=False, name=None):
+        graph_transit.add_node(stop_id, pos=geometry, stop_name=stop_name, routes=routes, shapes=shapes)
         for next_stop_id, edge_list in next_stops.items():
             for edge in edge_list:                
                 graph_transit.add_edge(stop_id, next_stop_id, weight=edge['weight'], shape_id=edge['shape_id'], frequency=edge['frequency'])
@@ -92,22 +190,25 @@ def add_walking_edges(graph_transit: nx.MultiDiGraph, stops_gdf: gpd.GeoDataFram
     # Use spatial index to efficiently find nearby stops
     sindex = stops_gdf.sindex
 
-    for stop_idx, stop in stops_gdf.iterrows():
-        stop_id = stop['stop_id']
-        stop_point_geo = stop['geometry']
-        stop_circle_walking = stop_point_geo.buffer(walking_distance)
-
-        # candidate indices whose geometries intersect the walking reach
-        nearby_stops_idx = sindex.query(stop_circle_walking, predicate="intersects")
-
-        for nearby_stop_idx in nearby_stops_idx:
-            # we dont want to add walking edge to itself
-            if nearby_stop_idx == stop_idx:
-                continue
-            nearby_stop = stops_gdf.iloc[nearby_stop_idx]
-            #calculate real distance in meters between the two stops
-            distance = stop_point_geo.distance(nearby_stop['geometry'])            
-            # walking time in seconds
-            walking_time = round(distance / walking_speed_mps) 
-            # add walking edge, shape_id='walking' due to the mode of transport, frequency=0 as its not a scheduled transport you have to wait
-            graph_transit.add_edge(stop_id, nearby_stop['stop_id'], weight=walking_time, shape_id='walking', frequency=0)
\ No newline at end of file
+    stop_ids = stops_gdf['stop_id'].to_numpy()
+    stop_points = np.asarray(stops_gdf.geometry)
+    stop_circles_walking = stops_gdf.geometry.buffer(walking_distance)
+
+    # candidate (stop, nearby stop) positional pairs whose geometries intersect the walking reach
+    stop_idx, nearby_idx = sindex.query(stop_circles_walking, predicate="intersects")
+
+    # we dont want to add walking edge to itself
+    not_self = stop_idx != nearby_idx
+    stop_idx = stop_idx[not_self]
+    nearby_idx = nearby_idx[not_self]
+
+    #calculate real distance in meters between all the pairs at once
+    distances = shapely.distance(stop_points[stop_idx], stop_points[nearby_idx])
+    # walking time in seconds
+    walking_times = np.round(distances / walking_speed_mps).astype(int)
+
+    # add walking edges, shape_id='walking' due to the mode of transport, frequency=0 as its not a scheduled transport you have to wait
+    graph_transit.add_edges_from(
+        (stop_id, nearby_stop_id, {'weight': walking_time, 'shape_id': 'walking', 'frequency': 0})
+        for stop_id, nearby_stop_id, walking_time in zip(stop_ids[stop_idx], stop_ids[nearby_idx], walking_times.tolist())
+    )
@@ -1,10 +1,14 @@
 
 import pandas as pd
+import numpy as np
 import geopandas as gpd
-from shapely.geometry import LineString, Point
+import shapely
+from shapely.geometry import Point
 from collections import defaultdict
 import os
 import pickle
+import hashlib
+from pathlib import Path
 
 class GTFSLoader:
 
@@ -36,6 +40,12 @@ class GTFSLoader:
             transit_df = pd.read_pickle(pkl_path)
             return transit_df
 
+        # DataFrame already built from the same GTFS files
+        pkl_path = os.path.join(gtfs_folder, f"transit_df_{gtfs_cache_key(gtfs_folder)}.pkl")
+        if os.path.exists(pkl_path):
+            print(f"Loading transit DataFrame from {pkl_path}")
+            return pd.read_pickle(pkl_path)
+
         # If file doesn't exist, create the DataFrame
         print("Creating transit DataFrame from GTFS files")
 
@@ -47,20 +57,34 @@ class GTFSLoader:
         trips_df = pd.read_excel(f"{gtfs_folder}/trips_fixed.xlsx", dtype=str)
         trips_df = process_trips(trips_df)
 
+        # Ids kept after processing the trips, built once and shared by every filter below
+        trip_ids = pd.Index(trips_df['trip_id'].unique())
+        shape_ids = pd.Index(trips_df['shape_id'].unique())
+        route_ids = pd.Index(trips_df['route_id'].unique())
+
         # Based on the stop times get all the sequence of stops per trip and the time between each stop
         stop_times_df = pd.read_csv(f"{gtfs_folder}/stop_times.txt", dtype=str, low_memory=False)
-        stop_times_df = process_stops(stop_times_df, stop_times_df, trips_df)
+        stop_times_df = process_stops(stop_times_df, trips_df, trip_ids)
 
         # To get the average frequency of each trip
         frequencies_df = pd.read_csv(f"{gtfs_folder}/frequencies.txt", dtype=str, low_memory=False)
-        frequencies_df = process_frequencies(frequencies_df, trips_df)
-
-        shapes_df = pd.read_csv(f"{gtfs_folder}/shapes.txt", dtype=str, low_memory=False)
-        shapes_df = process_shapes(shapes_df, trips_df)
+        frequencies_df = process_frequencies(frequencies_df, trips_df, trip_ids)
+
+        # Coordinates and sequence are parsed as numbers directly by the CSV reader,
+        # float32 is enough for the shape points (under a meter) and halves their memory.
+        # Read by chunks keeping only the used shapes, so the whole file is never in memory at once
+        shapes_chunks = pd.read_csv(
+            f"{gtfs_folder}/shapes.txt",
+            usecols=['shape_id', 'shape_pt_lat', 'shape_pt_lon', 'shape_pt_sequence'],
+            dtype={'shape_id': str, 'shape_pt_lat': 'float32', 'shape_pt_lon': 'float32', 'shape_pt_sequence': 'int32'},
+            chunksize=1_000_000,
+        )
+        shapes_df = pd.concat([chunk[chunk['shape_id'].isin(shape_ids)] for chunk in shapes_chunks], ignore_index=True)
+        shapes_df = process_shapes(shapes_df, trips_df, shape_ids)
 
         # Filter used routes and fix colors and route types
         routes_df = pd.read_csv(f"{gtfs_folder}/routes.txt", dtype=str, low_memory=False)
-        routes_df = process_routes(routes_df, trips_df)
+        routes_df = process_routes(routes_df, trips_df, route_ids)
 
         # Now merge all the information into transit_df, use trips_df as base
         transit_df = trips_df#[['shape_id', 'route_id', 'trip_id', 'trip_headsign']] -> All columns "copied"
@@ -73,7 +97,8 @@ class GTFSLoader:
         # Add to the transit_df the information of frequencies per trip_id
         transit_df = transit_df.merge(frequencies_df[["trip_id", "frequency"]], on='trip_id', how='left')
 
-        transit_df.to_pickle(f"{gtfs_folder}/transit_df_py.pkl")
+        print(f"Saving transit DataFrame to {pkl_path}")
+        transit_df.to_pickle(pkl_path)
 
         return transit_df
 
@@ -96,6 +121,12 @@ class GTFSLoader:
             print(f"Loading stops DataFrame from {pkl_path}")
             stops_df = pd.read_pickle(pkl_path)
             return stops_df
+
+        # DataFrame already built from the same GTFS files
+        pkl_path = os.path.join(gtfs_folder, f"stops_df_{gtfs_cache_key(gtfs_folder)}.pkl")
+        if os.path.exists(pkl_path):
+            print(f"Loading stops DataFrame from {pkl_path}")
+            return pd.read_pickle(pkl_path)
         
         # If file doesn't exist, create the DataFrame
         print("Creating stops DataFrame from GTFS files")
@@ -117,6 +148,22 @@ class GTFSLoader:
         return stops_df
 
 
+def gtfs_cache_key(gtfs_folder: str) -> str:
+    """
+    Build a cache key from the GTFS source files of a folder.
+    The key changes whenever any .txt or .xlsx file is added, removed or modified
+    (name, modification time and size), so cached DataFrames are rebuilt only then.
+    Args:
+        gtfs_folder (str): Path to the folder containing GTFS files
+    Returns:
+        str: Hex key of the current state of the GTFS files
+    """
+    key = hashlib.blake2b(digest_size=8)
+    for p in sorted([*Path(gtfs_folder).glob("*.txt"), *Path(gtfs_folder).glob("*.xlsx")]):
+        stat = p.stat()
+        key.update(f"{p.name}:{stat.st_mtime_ns}:{stat.st_size};".encode())
+    return key.hexdigest()
+
 def process_stops_geometry(stops_df: pd.DataFrame) -> pd.DataFrame:
     """
     Process the stops DataFrame to include Point geometries for each stop location.
@@ -146,25 +193,29 @@ def process_stops_adjacency(stops_df: pd.DataFrame, transit_df: pd.DataFrame) ->
     Returns:
         pd.DataFrame: Processed DataFrame with adjacency information for stops
     """
-    # Use defaultdict to map stop_id to sets
-    next_stop_dict = defaultdict(dict)
+    # Use defaultdict to map (stop_id, next_stop_id) pairs and stop_id to sets
+    pair_edges = defaultdict(list)
     routes_dict = defaultdict(set)
     shapes_dict = defaultdict(set)
 
-    for stops_per_trip, stop_time_deltas, shape_id, route_id, frequency in zip(transit_df['stop_ids'], transit_df['stop_time_deltas'], transit_df['shape_id'], transit_df['route_id'], transit_df['frequency']):
-        for i in range(len(stops_per_trip)-1):
-            stop_id = stops_per_trip[i]
-            next_stop_id = stops_per_trip[i+1]
-            stop_time_delta = stop_time_deltas[i]
-            # if empty key, assign stop_time_delta and shape_id in a list
-            if next_stop_id not in next_stop_dict[stop_id]:
-                next_stop_dict[stop_id][next_stop_id] = [{'weight': stop_time_delta, 'shape_id': shape_id, 'frequency': frequency}]
-            # otherwise append to the list and update with the other ways to reach the next stop            
-            else:
-                next_stop_dict[stop_id][next_stop_id].append({'weight': stop_time_delta, 'shape_id': shape_id, 'frequency': frequency})
-            
-            routes_dict[stop_id].add(route_id)
-            shapes_dict[stop_id].add(shape_id)
+    # Only the columns needed for the adjacency, iterated as plain tuples
+    trips_view = transit_df[['stop_ids', 'stop_time_deltas', 'shape_id', 'route_id', 'frequency']]
+
+    # Local bindings for the hot loop
+    routes_by_stop = routes_dict.__getitem__
+    shapes_by_stop = shapes_dict.__getitem__
+
+    for stops_per_trip, stop_time_deltas, shape_id, route_id, frequency in trips_view.itertuples(index=False, name=None):
+        for stop_id, next_stop_id, stop_time_delta in zip(stops_per_trip, stops_per_trip[1:], stop_time_deltas):
+            # every way to reach the next stop is kept, grouped by the pair of stops
+            pair_edges[(stop_id, next_stop_id)].append((stop_time_delta, shape_id, frequency))
+            routes_by_stop(stop_id).add(route_id)
+            shapes_by_stop(stop_id).add(shape_id)
+
+    # Collapse the pairs into the adjacency dict stop_id -> {next_stop_id: [edges]}
+    next_stop_dict = defaultdict(dict)
+    for (stop_id, next_stop_id), edges in pair_edges.items():
+        next_stop_dict[stop_id][next_stop_id] = [{'weight': weight, 'shape_id': shape_id, 'frequency': frequency} for weight, shape_id, frequency in edges]
 
     # add columns from dictionaries
     stops_df['next_stop_id'] = stops_df['stop_id'].map(lambda x: next_stop_dict.get(x, dict()))
@@ -188,11 +239,8 @@ def process_trips(trips_df: pd.DataFrame) -> pd.DataFrame:
     service_priority = {'LD': 1, 'LS': 2, 'LV': 3}
     trips_df['service_prio'] = trips_df['service_id'].map(service_priority).fillna(99).astype(int)
 
-    # Sort by shape_id then priority so the preferred service is first
-    tmp = trips_df.sort_values(['shape_id', 'service_prio'])
-
-    # Drop duplicates to keep the chosen trip per shape
-    rep = tmp.drop_duplicates(subset='shape_id', keep='first')
+    # Keep the trip with the preferred service per shape (first one in the file on ties)
+    rep = trips_df.loc[trips_df.groupby('shape_id')['service_prio'].idxmin()]
 
     # DataFrame with the assignments
     trips_df = rep[['shape_id', 'route_id', 'trip_id', 'trip_headsign']]
@@ -202,19 +250,23 @@ def process_trips(trips_df: pd.DataFrame) -> pd.DataFrame:
 
     return trips_df
 
-def process_stops(stop_times_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.DataFrame:
+def process_stops(stop_times_df: pd.DataFrame, trips_df: pd.DataFrame, trip_ids: pd.Index = None) -> pd.DataFrame:
     """
     Process the stops DataFrame  and stop_times DataFrame to include the geometry of the stops.
     This function can include any necessary preprocessing steps for stops data.
     Args:
         stop_times_df (pd.DataFrame): DataFrame containing stop times and sequence of stops per trip
         trips_df (pd.DataFrame): DataFrame containing trip information used to filter valid trips only
+        trip_ids (pd.Index, optional): Precomputed trip_ids of trips_df, built from trips_df if not given
     Returns:
         pd.DataFrame: Processed stops DataFrame
     """
 
+    if trip_ids is None:
+        trip_ids = pd.Index(trips_df['trip_id'].unique())
+
     # Filter stop_times to only include trips present in trips_df
-    stop_times_df = stop_times_df[stop_times_df['trip_id'].isin(trips_df['trip_id'])]
+    stop_times_df = stop_times_df[stop_times_df['trip_id'].isin(trip_ids)]
 
     # Convert departure times to pandas Timedelta (handles >24:00:00)
     stop_times_df["departure_time"] = pd.to_timedelta(stop_times_df["departure_time"], errors="coerce")
@@ -222,7 +274,7 @@ def process_stops(stop_times_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.Dat
 
     # Aggregate stop_times by trip_id to create lists of stop_ids, stop_headsigns, and time deltas between consecutive stops
     def _condense_trip_info(g):
-        g = g.copy()
+        # sort_values already returns a new frame, no need to copy the group first
         g = g.sort_values('stop_sequence')
         stops = g['stop_id'].tolist()
         stop_headsigns = g['stop_headsign'].tolist()
@@ -235,7 +287,7 @@ def process_stops(stop_times_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.Dat
   
     return stop_times_df
 
-def process_frequencies(frequencies_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.DataFrame:
+def process_frequencies(frequencies_df: pd.DataFrame, trips_df: pd.DataFrame, trip_ids: pd.Index = None) -> pd.DataFrame:
     """
     Process the frequencies DataFrame to include only relevant trips and aggregate frequencies.
     This function filters frequencies to include only trips present in trips_df and aggregates
@@ -243,11 +295,15 @@ def process_frequencies(frequencies_df: pd.DataFrame, trips_df: pd.DataFrame) ->
     Args:
         frequencies_df (pd.DataFrame): DataFrame containing frequency information
         trips_df (pd.DataFrame): DataFrame containing trip information used to filter valid trips only
+        trip_ids (pd.Index, optional): Precomputed trip_ids of trips_df, built from trips_df if not given
     Returns:
         pd.DataFrame: Processed frequencies DataFrame
     """
+    if trip_ids is None:
+        trip_ids = pd.Index(trips_df['trip_id'].unique())
+
     # Filter frequencies to only include trips present in trips_df
-    frequencies_df = frequencies_df[frequencies_df['trip_id'].isin(trips_df['trip_id'])]
+    frequencies_df = frequencies_df[frequencies_df['trip_id'].isin(trip_ids)]
 
     # Convert headway_secs to numeric
     frequencies_df['frequency'] = pd.to_numeric(frequencies_df['headway_secs'], errors='coerce')
@@ -257,53 +313,59 @@ def process_frequencies(frequencies_df: pd.DataFrame, trips_df: pd.DataFrame) ->
 
     return frequencies_df
 
-def process_shapes(shapes_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.DataFrame:
+def process_shapes(shapes_df: pd.DataFrame, trips_df: pd.DataFrame, shape_ids: pd.Index = None) -> pd.DataFrame:
     """
     Process the shapes DataFrame to create LineString geometries for each shape_id.
     This function filters shapes to include only those present in trips_df and constructs
     LineString geometries from the shape points.
     Args:
-        shapes_df (pd.DataFrame): DataFrame containing shape information
+        shapes_df (pd.DataFrame): DataFrame containing shape information, with numeric coordinates and sequence
         trips_df (pd.DataFrame): DataFrame containing trip information used to filter valid shapes only
+        shape_ids (pd.Index, optional): Precomputed shape_ids of trips_df, built from trips_df if not given
     Returns:
         pd.DataFrame: Processed shapes DataFrame with LineString geometries
     """
+    if shape_ids is None:
+        shape_ids = pd.Index(trips_df['shape_id'].unique())
+
     # Filter shapes to only include those present in trips_df
-    shapes_df = shapes_df[shapes_df['shape_id'].isin(trips_df['shape_id'])]
-
-    # Convert shape_pt_lat and shape_pt_lon to numeric
-    shapes_df['shape_pt_lat'] = pd.to_numeric(shapes_df['shape_pt_lat'], errors='coerce')
-    shapes_df['shape_pt_lon'] = pd.to_numeric(shapes_df['shape_pt_lon'], errors='coerce')
-    shapes_df['shape_pt_sequence'] = pd.to_numeric(shapes_df['shape_pt_sequence'], errors='coerce')
-
-    # Aggregate shape points into LineString geometries
-    def _create_shape_linestring(g):
-        g = g.sort_values('shape_pt_sequence')
-        coords = list(zip(g['shape_pt_lon'], g['shape_pt_lat']))  # Note: (lon, lat) for Point
-        if len(coords) == 0:
-            return None
-        elif len(coords) == 1:
-            return Point(coords[0])
-        else:
-            return LineString(coords)
-
-    shapes_geom = shapes_df.groupby('shape_id').apply(_create_shape_linestring).reset_index()
-    shapes_geom.columns = ['shape_id', 'shape_geometry']
+    shapes_df = shapes_df[shapes_df['shape_id'].isin(shape_ids)]
+
+    # Sort the points of every shape so each shape is a contiguous run in sequence order
+    shapes_df = shapes_df.sort_values(['shape_id', 'shape_pt_sequence'])
+
+    # Runs of each shape in the sorted rows, the group id of every point is the run it belongs to
+    unique_shape_ids, counts = np.unique(shapes_df['shape_id'].to_numpy(), return_counts=True)
+    codes = np.repeat(np.arange(len(unique_shape_ids)), counts)
+    # GEOS works in float64, upcast only when building the geometries
+    coords = shapes_df[['shape_pt_lon', 'shape_pt_lat']].to_numpy(dtype=np.float64)  # Note: (lon, lat) for Point
+
+    # Build all the geometries in one call, shapes with a single point become a Point
+    geometries = np.full(len(unique_shape_ids), None, dtype=object)
+    is_line = counts[codes] > 1
+    shapely.linestrings(coords[is_line], indices=codes[is_line], out=geometries)
+    geometries[codes[~is_line]] = shapely.points(coords[~is_line])
+
+    shapes_geom = pd.DataFrame({'shape_id': unique_shape_ids, 'shape_geometry': geometries})
 
     return shapes_geom
 
-def process_routes(routes_df: pd.DataFrame, trips_df: pd.DataFrame) -> pd.DataFrame:
+def process_routes(routes_df: pd.DataFrame, trips_df: pd.DataFrame, route_ids: pd.Index = None) -> pd.DataFrame:
     """
     Process the routes DataFrame to include only relevant routes.
     This function filters routes to include only those present in trips_df and modifies route colors and route types.
     Args:
         routes_df (pd.DataFrame): DataFrame containing route information
         trips_df (pd.DataFrame): DataFrame containing trip information used to filter valid routes only
+        route_ids (pd.Index, optional): Precomputed route_ids of trips_df, built from trips_df if not given
     Returns:
         pd.DataFrame: Processed routes DataFrame
     """
+    if route_ids is None:
+        route_ids = pd.Index(trips_df['route_id'].unique())
+
     # Filter routes to only include those present in trips_df
-    routes_df = routes_df[routes_df['route_id'].isin(trips_df['route_id'])]
+    routes_df = routes_df[routes_df['route_id'].isin(route_ids)]
 
     # Add "#" to the colors of the routes_df
     routes_df['route_color'] = routes_df['route_color'].apply(lambda c: f"#{c}" if pd.notna(c) and not c.startswith('#') else c)
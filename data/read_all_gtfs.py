@@ -5,12 +5,25 @@ Usage examples:
   python data/read_all_gtfs.py --save outdir  # saves CSVs to `outdir`
 """
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+import csv
+import os
 import pandas as pd
 from typing import Dict
 
+try:
+    import pyarrow as pa
+    import pyarrow.csv as pacsv
+except ImportError:  # optional, pandas parses the CSV without it
+    pa = None
+    pacsv = None
+
 
 DEFAULT_GTFS_DIR = Path(__file__).parent / "gtfs"
 
+# Identifier columns repeated across the tables, stored as categories (integer codes)
+ID_COLUMNS = ("shape_id", "route_id", "trip_id", "stop_id", "service_id")
+
 
 def list_gtfs_files(gtfs_dir: Path = DEFAULT_GTFS_DIR):
     gtfs_dir = Path(gtfs_dir)
@@ -23,21 +36,95 @@ def read_gtfs_files(gtfs_dir: Path | str = None) -> Dict[str, pd.DataFrame]:
     """Read every `*.txt` file in `gtfs_dir` into a pandas DataFrame.
 
     Returns a dict mapping filename stem (e.g. `stops`) -> DataFrame.
-    All columns are read as strings to avoid dtype surprises.
+    All columns are read as strings to avoid dtype surprises, the identifier
+    columns in `ID_COLUMNS` as categorical strings.
     """
     gtfs_dir = Path(gtfs_dir) if gtfs_dir else DEFAULT_GTFS_DIR
     files = list_gtfs_files(gtfs_dir)
-    dfs: Dict[str, pd.DataFrame] = {}
-    for p in files:
-        key = p.stem
+    if not files:
+        return {}
+    # parsing releases the GIL, so the tables are read in parallel
+    with ThreadPoolExecutor(max_workers=min(8, len(files))) as ex:
+        dfs: Dict[str, pd.DataFrame] = dict(zip([p.stem for p in files], ex.map(read_gtfs_table, files)))
+    return dfs
+
+
+def read_gtfs_table(p: Path) -> pd.DataFrame:
+    """Read one GTFS `.txt` table, reusing its Parquet copy when up to date.
+
+    The parsed table is cached next to the `.txt` as `.parquet` and reused
+    while it is newer than the source. Parquet needs pyarrow; without it the
+    table is parsed from the CSV every time. An unreadable copy is rebuilt
+    from the CSV.
+    """
+    cache = p.with_suffix(".parquet")
+    if cache.exists() and cache.stat().st_mtime >= p.stat().st_mtime:
+        try:
+            return pd.read_parquet(cache)
+        except ImportError:
+            pass
+        except (OSError, ValueError):
+            # truncated or corrupt copy (Arrow errors are OSError/ValueError), parse the CSV again
+            pass
+
+    df = None
+    if pacsv is not None:
+        try:
+            df = read_csv_arrow(p)
+        except pa.ArrowInvalid:
+            df = None
+    if df is None:
         try:
             df = pd.read_csv(p, dtype=str, keep_default_na=False, na_values=[""], low_memory=False)
-            dfs[key] = df
         except Exception:
             # fallback: more tolerant reader
-            df = pd.read_csv(p, dtype=str, engine="python", low_memory=False, on_bad_lines="skip")
-            dfs[key] = df
-    return dfs
+            df = pd.read_csv(p, dtype=str, engine="python", on_bad_lines="skip")
+
+    df = categorize_ids(df)
+
+    # written to a temporary file and renamed, an interrupted write never leaves a partial copy
+    tmp = cache.with_suffix(".parquet.tmp")
+    try:
+        df.to_parquet(tmp, compression="zstd")
+        os.replace(tmp, cache)
+    except (ImportError, OSError, ValueError, TypeError):
+        # the cache is only an optimization: no pyarrow, read-only folder or
+        # columns Arrow cannot convert still return the parsed table
+        pass
+    finally:
+        try:
+            tmp.unlink(missing_ok=True)
+        except OSError:
+            pass
+    return df
+
+
+def categorize_ids(df: pd.DataFrame) -> pd.DataFrame:
+    """Convert the identifier columns present in `df` to category dtype."""
+    for col in ID_COLUMNS:
+        if col in df.columns:
+            df[col] = df[col].astype("category")
+    return df
+
+
+def read_csv_arrow(p: Path) -> pd.DataFrame:
+    """Parse a GTFS `.txt` with the multithreaded pyarrow CSV reader.
+
+    Every column is read as string and empty fields become missing values,
+    the same as the pandas reader.
+    """
+    with open(p, newline="", encoding="utf-8-sig") as f:
+        columns = next(csv.reader(f), [])
+    table = pacsv.read_csv(
+        p,
+        read_options=pacsv.ReadOptions(use_threads=True),
+        convert_options=pacsv.ConvertOptions(
+            column_types={c: pa.string() for c in columns},
+            strings_can_be_null=True,
+            null_values=[""],
+        ),
+    )
+    return table.to_pandas()
 
 
 def summarize_dfs(dfs: Dict[str, pd.DataFrame]):
@@ -1,16 +1,21 @@
-import json
 from pathlib import Path
+import numpy as np
 from PyQt5.QtWidgets import (
     QWidget, QVBoxLayout, QHBoxLayout,
     QLineEdit, QLabel, QPushButton, QListWidget, QListWidgetItem,
     QSplitter, QFrame
 )
 from PyQt5.QtCore import Qt
-from PyQt5.QtGui import QIcon
+from PyQt5.QtGui import QIcon, QColor
 from .map_widget import MapWidget
-from shapely.geometry import Point, shape as shp_shape
+import shapely
+from shapely.geometry import Point
+from shapely.prepared import prep
 from pyproj import Transformer
 
+# Transformer to metric (EPSG:3857), shared by every window
+TO_3857 = Transformer.from_crs(4326, 3857, always_xy=True)
+
 class MainWindow(QWidget):
     def __init__(self, route_service, polygon_path: str = None):
         super().__init__()
@@ -69,6 +74,7 @@ class MainWindow(QWidget):
         right_layout.setContentsMargins(8, 8, 8, 8)
         self.lbl_total = QLabel("Total: -")
         self.list_summary = QListWidget()
+        self.list_summary.setUniformItemSizes(True)
         right_layout.addWidget(QLabel("Resumen"))
         right_layout.addWidget(self.lbl_total)
         right_layout.addWidget(self.list_summary)
@@ -99,29 +105,33 @@ class MainWindow(QWidget):
 
         # Load polygon and set on map
         self.boundary_shape = None
+        self.boundary_prepared = None
         if polygon_path is None:
             polygon_path = str(Path(__file__).resolve().parents[1] / 'data' / 'osm' / 'jalisco.geojson.txt')
         try:
-            with open(polygon_path, 'r', encoding='utf-8') as f:
-                gj = json.load(f)
+            # Parsed once in GEOS, a malformed file raises here before anything reaches the page
+            gj = Path(polygon_path).read_text(encoding='utf-8')
+            # Keep shapely geometry for server-side validation (first feature of a FeatureCollection)
+            boundary = shapely.from_geojson(gj)
+            if boundary.geom_type == 'GeometryCollection':
+                boundary = boundary.geoms[0]
             self.map.set_polygon(gj)
-            # Keep shapely geometry for server-side validation
-            feat = gj['features'][0]
-            self.boundary_shape = shp_shape(feat['geometry'])
+            self.boundary_shape = boundary
+            # Prepared once so every point-in-polygon check uses its index
+            self.boundary_prepared = prep(self.boundary_shape)
         except Exception:
             self.boundary_shape = None
-
-        # Transformer to metric (EPSG:3857)
-        self.to_3857 = Transformer.from_crs(4326, 3857, always_xy=True)
+            self.boundary_prepared = None
 
     def toggle_widget(self, w: QWidget):
         w.setVisible(not w.isVisible())
 
     def _validate_inside(self, lat: float, lon: float) -> bool:
-        if self.boundary_shape is None:
+        if self.boundary_prepared is None:
             return True
         try:
-            return self.boundary_shape.contains(Point(lon, lat)) or self.boundary_shape.touches(Point(lon, lat))
+            # covers = inside or on the boundary
+            return self.boundary_prepared.covers(Point(lon, lat))
         except Exception:
             return True
 
@@ -149,11 +159,10 @@ class MainWindow(QWidget):
                 self.lbl_total.setText("Origen/Destino fuera del polígono")
                 return
 
-            # Project to meters EPSG:3857
-            ox, oy = self.to_3857.transform(olon, olat)
-            dx, dy = self.to_3857.transform(dlon, dlat)
-            p_o = Point(ox, oy)
-            p_d = Point(dx, dy)
+            # Project to meters EPSG:3857, both points in one call
+            xs, ys = TO_3857.transform(np.array([olon, dlon]), np.array([olat, dlat]))
+            p_o = Point(xs[0], ys[0])
+            p_d = Point(xs[1], ys[1])
 
             segments = None
             total_time = None
@@ -184,8 +193,8 @@ class MainWindow(QWidget):
 
             # Normalize segments for map drawing
             draw_segments = []
+            summary_items = []
             walking_time = 0
-            self.list_summary.clear()
             for seg in segments:
                 mode = seg.get('mode', 'transit')
                 coords = seg.get('coords') or seg.get('geometry') or []
@@ -215,17 +224,18 @@ class MainWindow(QWidget):
                     title = f"{rname} → {headsign}: {round((time_sec or 0)/60)} min"
                 item = QListWidgetItem(title)
                 if route_color:
-                    item.setForeground(Qt.white) if mode != 'walk' else None
-                    # Apply colored background for quick visual
-                    item_widget = QLabel(title)
+                    # Apply colored background for quick visual, on the item itself (no widget per row)
                     bg = route_color if mode != 'walk' else '#666666'
-                    item_widget.setStyleSheet(f"padding:6px; background:{bg}; color:white;")
-                    lw_item = QListWidgetItem()
-                    lw_item.setSizeHint(item_widget.sizeHint())
-                    self.list_summary.addItem(lw_item)
-                    self.list_summary.setItemWidget(lw_item, item_widget)
-                else:
-                    self.list_summary.addItem(item)
+                    item.setBackground(QColor(bg))
+                    item.setForeground(QColor('white'))
+                summary_items.append(item)
+
+            # Replace the summary in one pass, repainting the list once instead of once per segment
+            self.list_summary.setUpdatesEnabled(False)
+            self.list_summary.clear()
+            for item in summary_items:
+                self.list_summary.addItem(item)
+            self.list_summary.setUpdatesEnabled(True)
 
             if total_time is not None:
                 self.lbl_total.setText(f"Total: {round(total_time/60)} min (caminar ~{round(walking_time/60)} min)")
@@ -1,192 +1,96 @@
-from PyQt5.QtWebEngineWidgets import QWebEngineView
-from PyQt5.QtCore import QUrl
+from PyQt5.QtWebEngineWidgets import QWebEngineView, QWebEngineSettings
+from PyQt5.QtWebChannel import QWebChannel
+from PyQt5.QtCore import QObject, QUrl, pyqtSlot
+from pathlib import Path
 import json
 
-HTML = """
-<!DOCTYPE html>
-<html>
-<head>
-  <meta charset="utf-8"/>
-  <title>Leaflet Map</title>
-  <link rel="stylesheet" href="https://unpkg.com/leaflet/dist/leaflet.css" />
-  <script src="https://unpkg.com/leaflet/dist/leaflet.js"></script>
-  <link rel="stylesheet" href="https://unpkg.com/leaflet-control-geocoder/dist/Control.Geocoder.css" />
-  <script src="https://unpkg.com/leaflet-control-geocoder/dist/Control.Geocoder.js"></script>
-  <script src="https://unpkg.com/@turf/turf@6/turf.min.js"></script>
-  <style>
-    html, body { height:100%; margin:0; }
-    #map { width:100vw; height:100vh; }
-    .leaflet-control.geocoder-control input { width: 240px; }
-  </style>
-</head>
-<body>
-  <div id="map"></div>
-
-  <script>
-    var map = L.map('map').setView([20.67, -103.35], 12);
-
-    L.tileLayer('https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png', {
-      maxZoom: 19
-    }).addTo(map);
-
-    // Geocoder control for quick search
-    if (L.Control.Geocoder) {
-      L.Control.geocoder({ defaultMarkGeocode: false })
-        .on('markgeocode', function(e) {
-          var center = e.geocode.center;
-          map.setView(center, 16);
-        })
-        .addTo(map);
-    }
-
-    // State
-    window.boundaryLayer = null;
-    window.boundaryGeoJSON = null;
-    window.pickMode = 'none'; // 'origin' | 'dest' | 'none'
-    window.originMarker = null;
-    window.destMarker = null;
-    window.routeLayerGroup = L.layerGroup().addTo(map);
-
-    function pointInsideBoundary(latlng) {
-      if (!window.boundaryGeoJSON) return true; // allow if no boundary set
-      var pt = turf.point([latlng.lng, latlng.lat]);
-      var feat = window.boundaryGeoJSON.features ? window.boundaryGeoJSON.features[0] : window.boundaryGeoJSON;
-      try {
-        return turf.booleanPointInPolygon(pt, feat);
-      } catch(e) {
-        return true;
-      }
-    }
-
-    function setMarker(type, latlng) {
-      if (!pointInsideBoundary(latlng)) {
-        alert('El punto está fuera del polígono');
-        return;
-      }
-      if (type === 'origin') {
-        if (window.originMarker) map.removeLayer(window.originMarker);
-        window.originMarker = L.marker(latlng, { draggable: true }).addTo(map).bindPopup('Origen');
-        window.originMarker.on('dragend', function(ev){
-          if (!pointInsideBoundary(ev.target.getLatLng())) {
-            alert('Origen fuera del polígono');
-            ev.target.setLatLng(latlng);
-          }
-        });
-      } else if (type === 'dest') {
-        if (window.destMarker) map.removeLayer(window.destMarker);
-        window.destMarker = L.marker(latlng, { draggable: true }).addTo(map).bindPopup('Destino');
-        window.destMarker.on('dragend', function(ev){
-          if (!pointInsideBoundary(ev.target.getLatLng())) {
-            alert('Destino fuera del polígono');
-            ev.target.setLatLng(latlng);
-          }
-        });
-      }
-    }
-
-    map.on('click', function(e){
-      if (window.pickMode === 'origin' || window.pickMode === 'dest') {
-        setMarker(window.pickMode, e.latlng);
-      }
-    });
-
-    // Public API
-    window.setPolygon = function(geojson) {
-      try {
-        if (typeof geojson === 'string') geojson = JSON.parse(geojson);
-      } catch(e) {}
-      if (window.boundaryLayer) {
-        map.removeLayer(window.boundaryLayer);
-      }
-      window.boundaryGeoJSON = geojson;
-      window.boundaryLayer = L.geoJSON(geojson, { style: { color: '#3388ff', weight: 2, fill: false }}).addTo(map);
-      try {
-        map.fitBounds(window.boundaryLayer.getBounds());
-      } catch(e) {}
-    }
-
-    window.setPickMode = function(mode) {
-      window.pickMode = mode;
-    }
-
-    window.setPoint = function(type, lat, lng) {
-      setMarker(type, L.latLng(lat, lng));
-    }
-
-    window.getPoints = function() {
-      var o = window.originMarker ? [window.originMarker.getLatLng().lat, window.originMarker.getLatLng().lng] : null;
-      var d = window.destMarker ? [window.destMarker.getLatLng().lat, window.destMarker.getLatLng().lng] : null;
-      return { origin: o, dest: d };
-    }
-
-    window.searchAndSet = async function(type, query) {
-      const url = 'https://nominatim.openstreetmap.org/search?format=json&q=' + encodeURIComponent(query);
-      const res = await fetch(url, { headers: { 'Accept-Language': 'es' } });
-      const data = await res.json();
-      if (!data || !data.length) { alert('No se encontró ubicación'); return; }
-      const item = data[0];
-      const lat = parseFloat(item.lat), lon = parseFloat(item.lon);
-      setMarker(type, L.latLng(lat, lon));
-      map.setView([lat, lon], 16);
-    }
-
-    window.clearRoute = function(){
-      window.routeLayerGroup.clearLayers();
-    }
-
-    window.drawRoute = function(coords) {
-      window.clearRoute();
-      var line = L.polyline(coords, {color: 'red', weight: 5}).addTo(window.routeLayerGroup);
-      map.fitBounds(line.getBounds());
-    }
-
-    window.drawRouteSegments = function(segments) {
-      window.clearRoute();
-      var bounds = null;
-      segments.forEach(function(seg){
-        var color = seg.color || seg.route_color || (seg.mode === 'walk' ? '#666' : '#7b1fa2');
-        var weight = seg.weight || seg.width || 4;
-        var dash = seg.dashArray || (seg.mode === 'walk' ? '6,6' : null);
-        var pl = L.polyline(seg.coords, { color: color, weight: weight, dashArray: dash, opacity: 0.95 }).addTo(window.routeLayerGroup);
-        if (!bounds) bounds = pl.getBounds(); else bounds.extend(pl.getBounds());
-      });
-      if (bounds) map.fitBounds(bounds, { padding: [24,24] });
-    }
-  </script>
-</body>
-</html>
-"""
+try:
+    import orjson
+except ImportError:  # optional, json serializes the payloads without it
+    orjson = None
+
+# Leaflet page, loaded from disk with its CDN assets pinned to exact versions
+MAP_HTML_PATH = Path(__file__).resolve().parent / 'assets' / 'map.html'
+
+def to_js(obj) -> str:
+    """Serialize a payload (lists, dicts, NumPy arrays with orjson) as a JS literal."""
+    if orjson is not None:
+        return orjson.dumps(obj, option=orjson.OPT_SERIALIZE_NUMPY).decode()
+    return json.dumps(obj)
+
+class MapBridge(QObject):
+    """Object exposed to the page as `py`, the page reports marker changes to it."""
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.points = {'origin': None, 'dest': None}
+
+    @pyqtSlot(str, float, float)
+    def setPoint(self, which, lat, lng):
+        self.points[which] = [lat, lng]
 
 class MapWidget(QWebEngineView):
     def __init__(self):
         super().__init__()
-        self.setHtml(HTML)
+        # calls made before the page finishes loading are queued and replayed on load
+        self._loaded = False
+        self._pending_js = []
+        self.loadFinished.connect(self._on_load_finished)
+
+        self.bridge = MapBridge(self)
+        self.channel = QWebChannel(self)
+        self.channel.registerObject('py', self.bridge)
+        self.page().setWebChannel(self.channel)
+
+        # a file:// page treats every remote URL as cross-origin, searchAndSet's fetch() to Nominatim
+        # would be blocked without this (the inline page loaded with setHtml had no such restriction)
+        self.settings().setAttribute(QWebEngineSettings.LocalContentCanAccessRemoteUrls, True)
+        self.setUrl(QUrl.fromLocalFile(str(MAP_HTML_PATH)))
+
+    def _on_load_finished(self, ok):
+      self._loaded = True
+      pending, self._pending_js = self._pending_js, []
+      # one script per call, an error in one of them does not drop the ones after it
+      for js in pending:
+        self.page().runJavaScript(js)
+
+    def _run_js(self, js):
+      if self._loaded:
+        self.page().runJavaScript(js)
+      else:
+        self._pending_js.append(js)
 
     def draw_route(self, coordinates):
         # coordinates = [ [lat, lon], [lat, lon], ... ]
-        js = f"window.drawRoute({coordinates});"
-        self.page().runJavaScript(js)
+        js = f"window.drawRoute({to_js(coordinates)});"
+        self._run_js(js)
 
     def set_polygon(self, geojson_obj):
-      js_arg = json.dumps(geojson_obj)
-      self.page().runJavaScript(f"window.setPolygon({js_arg});")
+      # GeoJSON text is sent as a JS string literal and parsed by the page with JSON.parse
+      self._run_js(f"window.setPolygon({to_js(geojson_obj)});")
 
     def set_pick_mode(self, mode: str):
-      self.page().runJavaScript(f"window.setPickMode('{mode}');")
+      self._run_js(f"window.setPickMode('{mode}');")
 
     def set_point(self, which: str, lat: float, lon: float):
-      self.page().runJavaScript(f"window.setPoint('{which}', {lat}, {lon});")
+      self._run_js(f"window.setPoint('{which}', {lat}, {lon});")
 
     def get_points(self, callback):
-      self.page().runJavaScript("window.getPoints();", callback)
+      points = dict(self.bridge.points)
+      if points['origin'] is not None and points['dest'] is not None:
+        # kept up to date by the page through the web channel, no JS round-trip needed
+        callback(points)
+      else:
+        # bridge not synced yet (or qwebchannel.js did not load), ask the page directly
+        self.page().runJavaScript("window.getPoints();", callback)
 
     def search_and_set(self, which: str, query: str):
       q = json.dumps(query)
-      self.page().runJavaScript(f"window.searchAndSet('{which}', {q});")
+      self._run_js(f"window.searchAndSet('{which}', {q});")
 
     def draw_route_segments(self, segments: list):
-      js_arg = json.dumps(segments)
-      self.page().runJavaScript(f"window.drawRouteSegments({js_arg});")
+      js_arg = to_js(segments)
+      self._run_js(f"window.drawRouteSegments({js_arg});")
 
     def clear_route(self):
-      self.page().runJavaScript("window.clearRoute();")
+      self._run_js("window.clearRoute();")
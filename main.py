@@ -1,19 +1,21 @@
 import sys
 import argparse
 import random as rd
-from shapely.geometry import Point
-import folium
 
-from PyQt5.QtWidgets import QApplication
+def main(args):
 
-from data.graph_loader import GraphLoader
-from core.routing import RouteService
-from data.gtfs_loader import GTFSLoader
-from gui.main_window import MainWindow
+    # Heavy geo libraries are imported here and not at module level, so the argument parsing (--help) is immediate
+    from shapely.geometry import Point
+    import folium
 
-from core.routing import point_from_text, openMap
+    from data.graph_loader import GraphLoader
+    from core.routing import RouteService
+    from data.gtfs_loader import GTFSLoader
 
-def main(args):
+    from core.routing import point_from_text, openMap
+
+    #from PyQt5.QtWidgets import QApplication
+    #from gui.main_window import MainWindow
 
     #app = QApplication(sys.argv)
 
@@ -35,20 +37,19 @@ def main(args):
 
     route_service = RouteService(graph_walk, graph_transit, stops_df, transit_df)
 
+    # Lookups go through the Nominatim rate limiter, one per second, so they run one after the other
     src = point_from_text(args.src)
     dst = point_from_text(args.dst)
 
     if src is None or dst is None:
         print("No posible to geocode the provided addresses")
         #choose random points if geocoding fails
-        start = rd.choice(list(graph_walk.nodes))
-        destination = rd.choice(list(graph_walk.nodes))
+        start, destination = rd.sample(list(graph_walk.nodes), 2)
 
         src = Point(graph_walk.nodes[start]['x'], graph_walk.nodes[start]['y'])
         dst = Point(graph_walk.nodes[destination]['x'], graph_walk.nodes[destination]['y'])
 
     try:
-        route_service.route_combined(src, dst)
         total_time, m = route_service.route_combined(src, dst)
 
         folium.LayerControl().add_to(m)